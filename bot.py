@@ -1,14 +1,20 @@
 import os
+import asyncio
+import json
 import time
 import re
 import secrets
 import sqlite3
 import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict, Set
 
 import httpx
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import html as html_lib
 
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
@@ -22,7 +28,15 @@ MAILTM_BASE = "https://api.mail.tm"
 DB_PATH = "data.db"
 
 PORT = int(os.environ.get("PORT", "10000"))
+# public https base url; when set, Telegram pushes updates to PORT instead of long-polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
 POLL_EVERY_SECONDS = int(os.environ.get("POLL_EVERY_SECONDS", "12"))
+POLL_CONCURRENCY = int(os.environ.get("POLL_CONCURRENCY", "20"))
+DOMAIN_CACHE_TTL = 3600
+HTML_PARSE_LIMIT = 64 * 1024
+HTML_OFFLOAD_BYTES = 32 * 1024
+SEEN_CACHE_SIZE = 2000  # per chat, FIFO
+SEEN_RETENTION_DAYS = 7  # seen rows kept this long; see db_prune_seen for what pruning implies
 
 CONTACT_USERNAME = "@platoonleaderr"
 
@@ -61,252 +75,348 @@ MODE_MENU = ReplyKeyboardMarkup(
 # =========================
 # DATABASE
 # =========================
-def init_db() -> None:
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-
-    # mailboxes with per-user sequence user_seq + label
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS mailboxes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER NOT NULL,
-            user_seq INTEGER NOT NULL,
-            address TEXT NOT NULL,
-            password TEXT NOT NULL,
-            token TEXT NOT NULL,
-            label TEXT DEFAULT NULL,
-            created_at INTEGER NOT NULL,
-            UNIQUE(chat_id, user_seq),
-            UNIQUE(chat_id, address)
-        )
-        """
-    )
+def _open_db() -> sqlite3.Connection:
+    """One shared connection for the whole process (poll job + handlers)."""
+    con = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    # only takes effect on a fresh db (before the first table is created)
+    con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-32000")
+    con.execute("PRAGMA busy_timeout=5000")
+    return con
 
-    # migration: add label if older db
-    try:
-        cur.execute("ALTER TABLE mailboxes ADD COLUMN label TEXT")
-    except Exception:
-        pass
-
-    # active mailbox per user
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS active_mailbox (
-            chat_id INTEGER PRIMARY KEY,
-            mailbox_id INTEGER NOT NULL,
-            updated_at INTEGER NOT NULL
+
+_DB = _open_db()
+_DB_LOCK = threading.Lock()
+
+
+@contextmanager
+def _tx():
+    """Serialize access and run the block in a single transaction."""
+    with _DB_LOCK:
+        _DB.execute("BEGIN")
+        try:
+            yield _DB
+        except BaseException:
+            _DB.execute("ROLLBACK")
+            raise
+        _DB.execute("COMMIT")
+
+
+# bumped whenever init_db gains a one-shot migration (stored in PRAGMA user_version)
+SCHEMA_VERSION = 3
+
+
+def init_db() -> None:
+    # whole schema setup + migration in one transaction (one fsync)
+    with _tx() as con:
+        cur = con.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+
+        # schema v1: seen_messages becomes WITHOUT ROWID; move the old table aside
+        # so the CREATE below builds the new layout, then copy rows back
+        migrate_seen = False
+        if version < 1:
+            row = cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='seen_messages'").fetchone()
+            if row and "WITHOUT ROWID" not in row[0].upper():
+                cur.execute("ALTER TABLE seen_messages RENAME TO seen_messages_rowid")
+                migrate_seen = True
+
+        # mailboxes with per-user sequence user_seq + label
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS mailboxes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                user_seq INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                password TEXT NOT NULL,
+                token TEXT NOT NULL,
+                label TEXT DEFAULT NULL,
+                seen_pruned_at INTEGER DEFAULT NULL,
+                created_at INTEGER NOT NULL,
+                UNIQUE(chat_id, user_seq),
+                UNIQUE(chat_id, address)
+            )
+            """
         )
-        """
-    )
 
-    # seen messages
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS seen_messages (
-            chat_id INTEGER NOT NULL,
-            message_id TEXT NOT NULL,
-            seen_at INTEGER NOT NULL,
-            PRIMARY KEY(chat_id, message_id)
+        # active mailbox per user
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS active_mailbox (
+                chat_id INTEGER PRIMARY KEY,
+                mailbox_id INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+            """
         )
-        """
-    )
 
-    # Backfill user_seq for older rows where user_seq is NULL (safe no-op if already ok)
-    # If your DB was created by old versions, user_seq might exist but some rows may be NULL.
-    cur.execute("SELECT DISTINCT chat_id FROM mailboxes")
-    chat_ids = [r[0] for r in cur.fetchall()]
-    for cid in chat_ids:
+        # seen messages
         cur.execute(
-            "SELECT id, user_seq FROM mailboxes WHERE chat_id=? ORDER BY created_at ASC, id ASC",
-            (cid,),
+            """
+            CREATE TABLE IF NOT EXISTS seen_messages (
+                chat_id INTEGER NOT NULL,
+                message_id TEXT NOT NULL,
+                seen_at INTEGER NOT NULL,
+                mailbox_id INTEGER DEFAULT NULL,
+                PRIMARY KEY(chat_id, message_id)
+            ) WITHOUT ROWID
+            """
         )
-        rows = cur.fetchall()
-        seq = 0
-        for row_id, user_seq in rows:
-            if user_seq is None:
-                seq += 1
-                cur.execute("UPDATE mailboxes SET user_seq=? WHERE id=?", (seq, row_id))
-            else:
+        if migrate_seen:
+            cur.execute(
+                """
+                INSERT OR IGNORE INTO seen_messages(chat_id, message_id, seen_at)
+                SELECT chat_id, message_id, seen_at FROM seen_messages_rowid
+                """
+            )
+            cur.execute("DROP TABLE seen_messages_rowid")
+
+        # schema v2: add label if older db + backfill user_seq (skipped on warm starts)
+        if version < 2:
+            try:
+                cur.execute("ALTER TABLE mailboxes ADD COLUMN label TEXT")
+            except Exception:
+                pass
+
+            # Backfill user_seq for older rows where user_seq is NULL (safe no-op if already ok)
+            # If your DB was created by old versions, user_seq might exist but some rows may be NULL.
+            cur.execute("SELECT chat_id, id, user_seq FROM mailboxes ORDER BY chat_id, created_at ASC, id ASC")
+            updates = []
+            last_cid = None
+            seq = 0
+            for cid, row_id, user_seq in cur.fetchall():
+                if cid != last_cid:
+                    last_cid = cid
+                    seq = 0
+                if user_seq is None:
+                    seq += 1
+                    updates.append((seq, row_id))
+                else:
+                    try:
+                        seq = max(seq, int(user_seq))
+                    except Exception:
+                        pass
+            cur.executemany("UPDATE mailboxes SET user_seq=? WHERE id=?", updates)
+
+        # schema v3: seen rows remember their mailbox, mailboxes remember how far
+        # their seen rows were pruned (see db_prune_seen)
+        if version < 3:
+            for ddl in (
+                "ALTER TABLE seen_messages ADD COLUMN mailbox_id INTEGER DEFAULT NULL",
+                "ALTER TABLE mailboxes ADD COLUMN seen_pruned_at INTEGER DEFAULT NULL",
+            ):
                 try:
-                    seq = max(seq, int(user_seq))
+                    cur.execute(ddl)
                 except Exception:
                     pass
 
-    con.commit()
-    con.close()
+        if version < SCHEMA_VERSION:
+            cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
 
 
 def db_save_mailbox(chat_id: int, address: str, password: str, token: str) -> int:
     """Assign per-user sequence (user_seq): 1,2,3... for each user"""
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-
-    cur.execute("SELECT COALESCE(MAX(user_seq), 0) + 1 FROM mailboxes WHERE chat_id=?", (chat_id,))
-    next_seq = cur.fetchone()[0]
-
-    cur.execute(
-        """
-        INSERT OR IGNORE INTO mailboxes(chat_id, user_seq, address, password, token, label, created_at)
-        VALUES (?, ?, ?, ?, ?, NULL, ?)
-        """,
-        (chat_id, next_seq, address, password, token, int(time.time())),
-    )
-    con.commit()
-
-    cur.execute("SELECT id FROM mailboxes WHERE chat_id=? AND address=?", (chat_id, address))
-    mailbox_id = cur.fetchone()[0]
-    con.close()
-    return mailbox_id
+    with _tx() as con:
+        next_seq = con.execute(
+            "SELECT COALESCE(MAX(user_seq), 0) + 1 FROM mailboxes WHERE chat_id=?", (chat_id,)
+        ).fetchone()[0]
+
+        row = con.execute(
+            """
+            INSERT OR IGNORE INTO mailboxes(chat_id, user_seq, address, password, token, label, created_at)
+            VALUES (?, ?, ?, ?, ?, NULL, ?)
+            RETURNING id
+            """,
+            (chat_id, next_seq, address, password, token, int(time.time())),
+        ).fetchone()
+        if row is None:
+            # address already saved for this chat (insert ignored)
+            row = con.execute("SELECT id FROM mailboxes WHERE chat_id=? AND address=?", (chat_id, address)).fetchone()
+    return row[0]
 
 
 def db_list_mailboxes(chat_id: int) -> List[Tuple[int, int, str, Optional[str], int]]:
     """[(db_id, user_seq, address, label, created_at), ...]"""
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT id, user_seq, address, label, created_at FROM mailboxes WHERE chat_id=? ORDER BY user_seq DESC",
-        (chat_id,),
-    )
-    rows = cur.fetchall()
-    con.close()
-    return rows
+    with _DB_LOCK:
+        return _DB.execute(
+            "SELECT id, user_seq, address, label, created_at FROM mailboxes WHERE chat_id=? ORDER BY user_seq DESC",
+            (chat_id,),
+        ).fetchall()
 
 
 def db_get_mailbox_by_seq(chat_id: int, user_seq: int) -> Optional[Tuple[int, str, Optional[str]]]:
     """(db_id, address, label) or None"""
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT id, address, label FROM mailboxes WHERE chat_id=? AND user_seq=?",
-        (chat_id, user_seq),
-    )
-    row = cur.fetchone()
-    con.close()
-    return row
+    with _DB_LOCK:
+        return _DB.execute(
+            "SELECT id, address, label FROM mailboxes WHERE chat_id=? AND user_seq=?",
+            (chat_id, user_seq),
+        ).fetchone()
 
 
 def db_set_active_mailbox(chat_id: int, mailbox_id: int) -> None:
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO active_mailbox(chat_id, mailbox_id, updated_at)
-        VALUES (?, ?, ?)
-        ON CONFLICT(chat_id) DO UPDATE SET
-          mailbox_id=excluded.mailbox_id,
-          updated_at=excluded.updated_at
-        """,
-        (chat_id, mailbox_id, int(time.time())),
-    )
-    con.commit()
-    con.close()
+    with _DB_LOCK:
+        _DB.execute(
+            """
+            INSERT INTO active_mailbox(chat_id, mailbox_id, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+              mailbox_id=excluded.mailbox_id,
+              updated_at=excluded.updated_at
+            """,
+            (chat_id, mailbox_id, int(time.time())),
+        )
 
 
 def db_get_active_mailbox(chat_id: int) -> Optional[Tuple[int, str, str]]:
     """(mailbox_db_id, address, token)"""
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        """
-        SELECT m.id, m.address, m.token
-        FROM active_mailbox a
-        JOIN mailboxes m ON m.id = a.mailbox_id
-        WHERE a.chat_id = ?
-        """,
-        (chat_id,),
-    )
-    row = cur.fetchone()
-    con.close()
-    return row
+    with _DB_LOCK:
+        return _DB.execute(
+            """
+            SELECT m.id, m.address, m.token
+            FROM active_mailbox a
+            JOIN mailboxes m ON m.id = a.mailbox_id
+            WHERE a.chat_id = ?
+            """,
+            (chat_id,),
+        ).fetchone()
+
+
+def db_list_active_mailboxes() -> List[Tuple[int, int, str, Optional[int]]]:
+    """[(chat_id, mailbox_db_id, token, seen_pruned_at), ...]"""
+    with _DB_LOCK:
+        return _DB.execute(
+            """
+            SELECT a.chat_id, m.id, m.token, m.seen_pruned_at
+            FROM active_mailbox a
+            JOIN mailboxes m ON m.id = a.mailbox_id
+            """
+        ).fetchall()
 
 
 def db_delete_active_mailbox_only(chat_id: int) -> None:
     """Remove only active selection; saved list remains"""
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("DELETE FROM active_mailbox WHERE chat_id=?", (chat_id,))
-    con.commit()
-    con.close()
+    with _DB_LOCK:
+        _DB.execute("DELETE FROM active_mailbox WHERE chat_id=?", (chat_id,))
 
 
 def db_delete_saved_by_seq(chat_id: int, user_seq: int) -> bool:
     """Delete saved mailbox by per-user ID (user_seq). Returns True if deleted."""
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-
-    # Find db_id
-    cur.execute("SELECT id FROM mailboxes WHERE chat_id=? AND user_seq=?", (chat_id, user_seq))
-    row = cur.fetchone()
-    if not row:
-        con.close()
-        return False
-    db_id = row[0]
-
-    # If it is active, remove active pointer too
-    cur.execute("DELETE FROM active_mailbox WHERE chat_id=? AND mailbox_id=?", (chat_id, db_id))
-    cur.execute("DELETE FROM mailboxes WHERE chat_id=? AND id=?", (chat_id, db_id))
-
-    con.commit()
-    con.close()
+    with _tx() as con:
+        # Find db_id
+        row = con.execute("SELECT id FROM mailboxes WHERE chat_id=? AND user_seq=?", (chat_id, user_seq)).fetchone()
+        if not row:
+            return False
+        db_id = row[0]
+
+        # If it is active, remove active pointer too
+        con.execute("DELETE FROM active_mailbox WHERE chat_id=? AND mailbox_id=?", (chat_id, db_id))
+        con.execute("DELETE FROM mailboxes WHERE chat_id=? AND id=?", (chat_id, db_id))
     return True
 
 
 def db_set_label_by_seq(chat_id: int, user_seq: int, label: str) -> bool:
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("UPDATE mailboxes SET label=? WHERE chat_id=? AND user_seq=?", (label, chat_id, user_seq))
-    changed = cur.rowcount > 0
-    con.commit()
-    con.close()
-    return changed
-
-
-def db_get_token(chat_id: int, mailbox_id: int) -> Optional[str]:
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT token FROM mailboxes WHERE chat_id=? AND id=?", (chat_id, mailbox_id))
-    row = cur.fetchone()
-    con.close()
-    return row[0] if row else None
-
-
-def db_is_seen(chat_id: int, message_id: str) -> bool:
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        "SELECT 1 FROM seen_messages WHERE chat_id=? AND message_id=? LIMIT 1",
-        (chat_id, message_id),
-    )
-    row = cur.fetchone()
-    con.close()
-    return row is not None
+    with _DB_LOCK:
+        cur = _DB.execute("UPDATE mailboxes SET label=? WHERE chat_id=? AND user_seq=?", (label, chat_id, user_seq))
+        return cur.rowcount > 0
+
+
+def db_get_unseen(chat_id: int, message_ids: List[str]) -> set:
+    """Subset of message_ids not yet delivered to this chat (one query)"""
+    if not message_ids:
+        return set()
+    with _DB_LOCK:
+        # ids passed as one JSON array so the statement text is constant (cacheable)
+        rows = _DB.execute(
+            """
+            SELECT value FROM json_each(?)
+            EXCEPT
+            SELECT message_id FROM seen_messages WHERE chat_id=?
+            """,
+            (json.dumps(message_ids), chat_id),
+        ).fetchall()
+    return {r[0] for r in rows}
+
+
+def db_load_seen(chat_id: int, limit: int) -> List[str]:
+    """Most recent seen message ids for a chat, oldest-first"""
+    with _DB_LOCK:
+        rows = _DB.execute(
+            "SELECT message_id FROM seen_messages WHERE chat_id=? ORDER BY seen_at DESC LIMIT ?",
+            (chat_id, limit),
+        ).fetchall()
+    return [r[0] for r in reversed(rows)]
+
+
+def db_mark_seen_many(rows: List[Tuple[int, str, int, int]]) -> None:
+    """rows: [(chat_id, message_id, seen_at, mailbox_id), ...] written in one transaction"""
+    if not rows:
+        return
+    with _tx() as con:
+        con.executemany(
+            "INSERT OR IGNORE INTO seen_messages(chat_id, message_id, seen_at, mailbox_id) VALUES (?, ?, ?, ?)",
+            rows,
+        )
 
 
-def db_mark_seen(chat_id: int, message_id: str) -> None:
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute(
-        "INSERT OR IGNORE INTO seen_messages(chat_id, message_id, seen_at) VALUES (?, ?, ?)",
-        (chat_id, message_id, int(time.time())),
-    )
-    con.commit()
-    con.close()
+def db_prune_seen(older_than: int) -> int:
+    """Drop seen rows older than the given unix time; returns rows deleted
+
+    mail.tm keeps messages, so a pruned id will be listed again. Each mailbox
+    records the newest seen_at it lost (seen_pruned_at); a mail created at or
+    before that may have been delivered already and is skipped by the poll,
+    while newer mail (e.g. received while the mailbox was inactive) still goes
+    out. Rows from before schema v3 have no mailbox_id and are never pruned.
+    """
+    with _tx() as con:
+        con.execute(
+            """
+            UPDATE mailboxes SET seen_pruned_at = MAX(
+                COALESCE(seen_pruned_at, 0),
+                (SELECT MAX(s.seen_at) FROM seen_messages s WHERE s.mailbox_id = mailboxes.id AND s.seen_at < ?)
+            )
+            WHERE id IN (SELECT mailbox_id FROM seen_messages WHERE seen_at < ?)
+            """,
+            (older_than, older_than),
+        )
+        deleted = con.execute(
+            "DELETE FROM seen_messages WHERE seen_at < ? AND mailbox_id IS NOT NULL", (older_than,)
+        ).rowcount
+    with _DB_LOCK:
+        # execute() steps the pragma once (frees one page); executescript runs it to completion
+        _DB.executescript("PRAGMA incremental_vacuum;")
+        _DB.execute("PRAGMA optimize")
+    return deleted
+
+
+async def adb(fn, *args):
+    """Run a blocking db_* helper in a worker thread (keeps the event loop free)"""
+    return await asyncio.to_thread(fn, *args)
 
 
 # =========================
 # MAIL.TM
 # =========================
+_DOMAIN_CACHE = {"domains": [], "ts": 0.0}
+
+
 async def mailtm_get_random_domain(client: httpx.AsyncClient) -> str:
-    r = await client.get(f"{MAILTM_BASE}/domains?page=1")
+    # domain list changes rarely; refetch at most once per DOMAIN_CACHE_TTL
+    if _DOMAIN_CACHE["domains"] and time.time() - _DOMAIN_CACHE["ts"] < DOMAIN_CACHE_TTL:
+        return secrets.choice(_DOMAIN_CACHE["domains"])
+
+    r = await client.get("/domains?page=1")
     r.raise_for_status()
     items = r.json().get("hydra:member", [])
     if not items:
         raise RuntimeError("No domains available right now.")
-    for d in items:
-        if d.get("isActive"):
-            return d["domain"]
-    return items[0]["domain"]
+    domains = [d["domain"] for d in items if d.get("isActive")] or [items[0]["domain"]]
+    _DOMAIN_CACHE["domains"] = domains
+    _DOMAIN_CACHE["ts"] = time.time()
+    return secrets.choice(domains)
 
 
 async def mailtm_create_account_and_token(client: httpx.AsyncClient) -> Tuple[str, str, str]:
@@ -314,13 +424,13 @@ async def mailtm_create_account_and_token(client: httpx.AsyncClient) -> Tuple[st
     address = f"{secrets.token_hex(6)}@{domain}"
     password = secrets.token_urlsafe(12)
 
-    r1 = await client.post(f"{MAILTM_BASE}/accounts", json={"address": address, "password": password})
+    r1 = await client.post("/accounts", json={"address": address, "password": password})
     if r1.status_code >= 400:
         address = f"{secrets.token_hex(7)}@{domain}"
-        r1 = await client.post(f"{MAILTM_BASE}/accounts", json={"address": address, "password": password})
+        r1 = await client.post("/accounts", json={"address": address, "password": password})
     r1.raise_for_status()
 
-    r2 = await client.post(f"{MAILTM_BASE}/token", json={"address": address, "password": password})
+    r2 = await client.post("/token", json={"address": address, "password": password})
     r2.raise_for_status()
     token = r2.json()["token"]
     return address, password, token
@@ -328,7 +438,7 @@ async def mailtm_create_account_and_token(client: httpx.AsyncClient) -> Tuple[st
 
 async def mailtm_list_messages(client: httpx.AsyncClient, token: str):
     r = await client.get(
-        f"{MAILTM_BASE}/messages?page=1",
+        "/messages?page=1",
         headers={"Authorization": f"Bearer {token}"},
     )
     r.raise_for_status()
@@ -337,7 +447,7 @@ async def mailtm_list_messages(client: httpx.AsyncClient, token: str):
 
 async def mailtm_read_message(client: httpx.AsyncClient, token: str, msg_id: str):
     r = await client.get(
-        f"{MAILTM_BASE}/messages/{msg_id}",
+        f"/messages/{msg_id}",
         headers={"Authorization": f"Bearer {token}"},
     )
     r.raise_for_status()
@@ -348,6 +458,8 @@ async def mailtm_read_message(client: httpx.AsyncClient, token: str, msg_id: str
 # HTML -> TEXT + OTP detector
 # =========================
 OTP_RE = re.compile(r"(?<!\d)(\d{4,8})(?!\d)")
+# cheap pre-scan (no lookarounds): most mails have no 4-digit run at all
+DIGIT_RUN_RE = re.compile(r"\d{4}")
 
 def html_to_text(html_content) -> str:
     if isinstance(html_content, list):
@@ -356,30 +468,55 @@ def html_to_text(html_content) -> str:
         return ""
 
     html_content = html_lib.unescape(html_content)
-    soup = BeautifulSoup(html_content, "html.parser")
-    for tag in soup(["script", "style", "noscript"]):
-        tag.decompose()
-
-    text = soup.get_text(separator="\n")
+    try:
+        tree = LexborHTMLParser(html_content)
+        for tag in tree.css("script, style, noscript"):
+            tag.decompose()
+        root = tree.body or tree.root
+        text = root.text(separator="\n") if root is not None else ""
+    except Exception:
+        # fallback: slower pure-python parser
+        soup = BeautifulSoup(html_content, "html.parser")
+        for tag in soup(["script", "style", "noscript"]):
+            tag.decompose()
+        text = soup.get_text(separator="\n")
     lines = [ln.strip() for ln in text.splitlines()]
     lines = [ln for ln in lines if ln]
     return "\n".join(lines)
 
 
 def extract_otp(text: str) -> Optional[str]:
-    # take first match (most common)
-    m = OTP_RE.search(text or "")
+    text = text or ""
+    hint = DIGIT_RUN_RE.search(text)
+    if not hint:
+        return None
+    # take first match (most common); nothing can match before the first run
+    m = OTP_RE.search(text, hint.start())
     return m.group(1) if m else None
 
 
-def format_full_message(msg: dict) -> str:
+def clip_html(msg: dict) -> str:
+    """HTML format_full_message would parse: "" when plaintext exists, else joined and clipped"""
+    if (msg.get("text") or "").strip():
+        return ""
+    html = msg.get("html")
+    if isinstance(html, list):
+        html = "\n".join(x for x in html if isinstance(x, str))
+    if not isinstance(html, str):
+        return ""
+    # bound parse cost; only the first 3200 chars of text are shown anyway
+    return html[:HTML_PARSE_LIMIT]
+
+
+def format_full_message(msg: dict) -> Tuple[str, Optional[str]]:
+    """(telegram HTML text, otp or None)"""
     frm = (msg.get("from") or {}).get("address", "unknown")
     subj = msg.get("subject") or "(no subject)"
     created = msg.get("createdAt") or ""
 
     text = (msg.get("text") or "").strip()
     if not text:
-        text = html_to_text(msg.get("html"))
+        text = html_to_text(clip_html(msg))
     if not text:
         text = "(empty body)"
 
@@ -391,7 +528,7 @@ def format_full_message(msg: dict) -> str:
 
     otp_line = f"🔐 <b>OTP:</b> <code>{otp}</code>\n\n" if otp else ""
 
-    return (
+    full_text = (
         f"📩 <b>New Email</b>\n"
         f"<b>From:</b> {frm}\n"
         f"<b>Subject:</b> {subj}\n"
@@ -399,19 +536,60 @@ def format_full_message(msg: dict) -> str:
         f"{otp_line}"
         f"{text}"
     )
+    return full_text, otp
 
 
-async def create_new_mail_for_chat(chat_id: int) -> str:
-    async with httpx.AsyncClient(timeout=25) as client:
-        address, password, token = await mailtm_create_account_and_token(client)
-    mailbox_id = db_save_mailbox(chat_id, address, password, token)
-    db_set_active_mailbox(chat_id, mailbox_id)
+async def create_new_mail_for_chat(client: httpx.AsyncClient, chat_id: int) -> str:
+    address, password, token = await mailtm_create_account_and_token(client)
+    mailbox_id = await adb(db_save_mailbox, chat_id, address, password, token)
+    await adb(db_set_active_mailbox, chat_id, mailbox_id)
     return address
 
 
 # =========================
 # TELEGRAM UI HANDLER
 # =========================
+async def _reply(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    menu: ReplyKeyboardMarkup,
+    **kwargs,
+) -> None:
+    """reply_text; keyboards are persistent per chat, so attach `menu` only if it isn't already shown"""
+    shown = context.chat_data.get("menu") is menu
+    await update.message.reply_text(text, reply_markup=None if shown else menu, **kwargs)
+    context.chat_data["menu"] = menu
+
+
+async def _send_new_mail(update: Update, context: ContextTypes.DEFAULT_TYPE, heading: str) -> None:
+    # updates are handled one at a time, so presses spammed while a mail was being
+    # created arrive after it: answer those sent before the last creation finished
+    # with the current address instead of creating another one (message dates have
+    # 1s resolution, so a press in that same second is answered the same way)
+    done_at = context.chat_data.get("new_mail_at")
+    if done_at and update.message.date < done_at:
+        active = await adb(db_get_active_mailbox, update.effective_chat.id)
+        if active:
+            await _reply(
+                update, context,
+                f"✅ Already created:\n<code>{active[1]}</code>",
+                parse_mode=ParseMode.HTML,
+                menu=MAIN_MENU,
+            )
+            return
+
+    await _reply(update, context, "Creating…", menu=MAIN_MENU)
+    address = await create_new_mail_for_chat(context.bot_data["http"], update.effective_chat.id)
+    context.chat_data["new_mail_at"] = datetime.now(timezone.utc)
+    await _reply(
+        update, context,
+        f"📧 <b>{heading}</b>\n<code>{address}</code>",
+        parse_mode=ParseMode.HTML,
+        menu=MAIN_MENU,
+    )
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     txt = (update.message.text or "").strip()
@@ -421,63 +599,53 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         context.user_data.pop("reuse_mode", None)
         context.user_data.pop("rename_mode", None)
         context.user_data.pop("delete_saved_mode", None)
-        await update.message.reply_text("Menu ✅", reply_markup=MAIN_MENU)
+        await _reply(update, context, "Menu ✅", menu=MAIN_MENU)
         return
 
     # /start => direct new mail
     if txt.lower() == "/start":
-        await update.message.reply_text("Creating…", reply_markup=MAIN_MENU)
-        address = await create_new_mail_for_chat(chat_id)
-        await update.message.reply_text(
-            f"📧 <b>Your mail:</b>\n<code>{address}</code>",
-            parse_mode=ParseMode.HTML,
-            reply_markup=MAIN_MENU,
-        )
+        context.chat_data.pop("menu", None)
+        await _send_new_mail(update, context, "Your mail:")
         return
 
     if txt == BTN_HELP:
-        await update.message.reply_text(f"Contact: {CONTACT_USERNAME}", reply_markup=MAIN_MENU)
+        await _reply(update, context, f"Contact: {CONTACT_USERNAME}", menu=MAIN_MENU)
         return
 
     if txt == BTN_CURRENT:
-        active = db_get_active_mailbox(chat_id)
+        active = await adb(db_get_active_mailbox, chat_id)
         if not active:
-            await update.message.reply_text("No active mail. Tap “Generate new mail”.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "No active mail. Tap “Generate new mail”.", menu=MAIN_MENU)
             return
         _db_id, address, _token = active
-        await update.message.reply_text(
+        await _reply(
+            update, context,
             f"📌 <b>Current mail:</b>\n<code>{address}</code>",
             parse_mode=ParseMode.HTML,
-            reply_markup=MAIN_MENU,
+            menu=MAIN_MENU,
         )
         return
 
     if txt == BTN_NEW:
-        await update.message.reply_text("Creating…", reply_markup=MAIN_MENU)
-        address = await create_new_mail_for_chat(chat_id)
-        await update.message.reply_text(
-            f"📧 <b>Your new mail:</b>\n<code>{address}</code>",
-            parse_mode=ParseMode.HTML,
-            reply_markup=MAIN_MENU,
-        )
+        await _send_new_mail(update, context, "Your new mail:")
         return
 
     if txt == BTN_DELETE:
-        active = db_get_active_mailbox(chat_id)
+        active = await adb(db_get_active_mailbox, chat_id)
         if not active:
-            await update.message.reply_text("No active mail.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "No active mail.", menu=MAIN_MENU)
             return
-        db_delete_active_mailbox_only(chat_id)
-        await update.message.reply_text("✅ Current mail removed (saved list is still there).", reply_markup=MAIN_MENU)
+        await adb(db_delete_active_mailbox_only, chat_id)
+        await _reply(update, context, "✅ Current mail removed (saved list is still there).", menu=MAIN_MENU)
         return
 
     if txt == BTN_LIST:
-        rows = db_list_mailboxes(chat_id)
+        rows = await adb(db_list_mailboxes, chat_id)
         if not rows:
-            await update.message.reply_text("No saved mails yet.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "No saved mails yet.", menu=MAIN_MENU)
             return
 
-        active = db_get_active_mailbox(chat_id)
+        active = await adb(db_get_active_mailbox, chat_id)
         active_db_id = active[0] if active else None
 
         lines = ["📜 <b>Your saved mails</b>\n"]
@@ -487,45 +655,48 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             lines.append(f"{mark} <code>{addr}</code>{label_txt}\n<b>ID:</b> <code>{user_seq}</code>\n")
 
         lines.append("Reuse: tap ♻️ Reuse → send ID\nRename: tap ✏️ Rename → send: ID Name\nDelete saved: tap 🧨 Delete saved → send ID")
-        await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.HTML, reply_markup=MAIN_MENU)
+        await _reply(update, context, "\n".join(lines), parse_mode=ParseMode.HTML, menu=MAIN_MENU)
         return
 
     if txt == BTN_REUSE:
-        rows = db_list_mailboxes(chat_id)
+        rows = await adb(db_list_mailboxes, chat_id)
         if not rows:
-            await update.message.reply_text("No saved mails to reuse.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "No saved mails to reuse.", menu=MAIN_MENU)
             return
         context.user_data["reuse_mode"] = True
-        await update.message.reply_text(
+        await _reply(
+            update, context,
             "♻️ Send the <b>ID</b> you want to reuse.\nExample: <code>1</code>",
             parse_mode=ParseMode.HTML,
-            reply_markup=MODE_MENU,
+            menu=MODE_MENU,
         )
         return
 
     if txt == BTN_RENAME:
-        rows = db_list_mailboxes(chat_id)
+        rows = await adb(db_list_mailboxes, chat_id)
         if not rows:
-            await update.message.reply_text("No saved mails to rename.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "No saved mails to rename.", menu=MAIN_MENU)
             return
         context.user_data["rename_mode"] = True
-        await update.message.reply_text(
+        await _reply(
+            update, context,
             "✏️ Send like this:\n<code>ID Name</code>\nExample: <code>2 Facebook</code>",
             parse_mode=ParseMode.HTML,
-            reply_markup=MODE_MENU,
+            menu=MODE_MENU,
         )
         return
 
     if txt == BTN_DELETE_SAVED:
-        rows = db_list_mailboxes(chat_id)
+        rows = await adb(db_list_mailboxes, chat_id)
         if not rows:
-            await update.message.reply_text("No saved mails to delete.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "No saved mails to delete.", menu=MAIN_MENU)
             return
         context.user_data["delete_saved_mode"] = True
-        await update.message.reply_text(
+        await _reply(
+            update, context,
             "🧨 Send the <b>ID</b> you want to delete from saved list.\nExample: <code>3</code>",
             parse_mode=ParseMode.HTML,
-            reply_markup=MODE_MENU,
+            menu=MODE_MENU,
         )
         return
 
@@ -533,33 +704,34 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if context.user_data.get("reuse_mode"):
         if txt.isdigit():
             seq = int(txt)
-            found = db_get_mailbox_by_seq(chat_id, seq)
+            found = await adb(db_get_mailbox_by_seq, chat_id, seq)
             if not found:
-                await update.message.reply_text("Invalid ID. Try again.", reply_markup=MODE_MENU)
+                await _reply(update, context, "Invalid ID. Try again.", menu=MODE_MENU)
                 return
             mailbox_db_id, address, _label = found
-            db_set_active_mailbox(chat_id, mailbox_db_id)
+            await adb(db_set_active_mailbox, chat_id, mailbox_db_id)
             context.user_data.pop("reuse_mode", None)
-            await update.message.reply_text(
+            await _reply(
+                update, context,
                 f"✅ Reusing:\n<code>{address}</code>",
                 parse_mode=ParseMode.HTML,
-                reply_markup=MAIN_MENU,
+                menu=MAIN_MENU,
             )
             return
-        await update.message.reply_text("Send numeric ID or tap Back.", reply_markup=MODE_MENU)
+        await _reply(update, context, "Send numeric ID or tap Back.", menu=MODE_MENU)
         return
 
     if context.user_data.get("delete_saved_mode"):
         if txt.isdigit():
             seq = int(txt)
-            ok = db_delete_saved_by_seq(chat_id, seq)
+            ok = await adb(db_delete_saved_by_seq, chat_id, seq)
             if not ok:
-                await update.message.reply_text("Invalid ID. Try again.", reply_markup=MODE_MENU)
+                await _reply(update, context, "Invalid ID. Try again.", menu=MODE_MENU)
                 return
             context.user_data.pop("delete_saved_mode", None)
-            await update.message.reply_text("✅ Deleted from saved list.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "✅ Deleted from saved list.", menu=MAIN_MENU)
             return
-        await update.message.reply_text("Send numeric ID or tap Back.", reply_markup=MODE_MENU)
+        await _reply(update, context, "Send numeric ID or tap Back.", menu=MODE_MENU)
         return
 
     if context.user_data.get("rename_mode"):
@@ -569,59 +741,170 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             name = parts[1].strip()
             if len(name) > 25:
                 name = name[:25]
-            ok = db_set_label_by_seq(chat_id, seq, name)
+            ok = await adb(db_set_label_by_seq, chat_id, seq, name)
             if not ok:
-                await update.message.reply_text("Invalid ID. Try again.", reply_markup=MODE_MENU)
+                await _reply(update, context, "Invalid ID. Try again.", menu=MODE_MENU)
                 return
             context.user_data.pop("rename_mode", None)
-            await update.message.reply_text("✅ Renamed successfully.", reply_markup=MAIN_MENU)
+            await _reply(update, context, "✅ Renamed successfully.", menu=MAIN_MENU)
             return
-        await update.message.reply_text("Format: ID Name (example: 2 Facebook) or tap Back.", reply_markup=MODE_MENU)
+        await _reply(update, context, "Format: ID Name (example: 2 Facebook) or tap Back.", menu=MODE_MENU)
         return
 
     # fallback
-    await update.message.reply_text("Use menu buttons 👇", reply_markup=MAIN_MENU)
+    await _reply(update, context, "Use menu buttons 👇", menu=MAIN_MENU)
 
 
 # =========================
 # AUTO-FORWARD (JobQueue)
 # =========================
+# chat_id -> seen message ids (dict used as an insertion-ordered set)
+SEEN: Dict[int, Dict[str, None]] = {}
+
+
+async def _load_seen(chat_id: int) -> Dict[str, None]:
+    seen = SEEN.get(chat_id)
+    if seen is None:
+        ids = await adb(db_load_seen, chat_id, SEEN_CACHE_SIZE)
+        seen = SEEN.setdefault(chat_id, dict.fromkeys(ids))
+    return seen
+
+
+def _remember_seen(chat_id: int, message_id: str) -> None:
+    """Call only after _load_seen(chat_id)"""
+    seen = SEEN[chat_id]
+    seen[message_id] = None
+    while len(seen) > SEEN_CACHE_SIZE:
+        del seen[next(iter(seen))]
+
+
+# chat_id -> task sending that chat's mail bodies (one at a time, oldest-first)
+BODY_TASKS: Dict[int, asyncio.Task] = {}
+# chat_id -> ids whose OTP line went out but whose body isn't delivered yet
+OTP_SENT: Dict[int, Set[str]] = {}
+# seen rows for delivered bodies; written in one transaction at the next poll
+PENDING_SEEN: List[Tuple[int, str, int, int]] = []
+
+
+def _created_ts(msg: dict) -> float:
+    """mail.tm createdAt as unix time (now if missing/unparseable)"""
+    try:
+        return datetime.fromisoformat(msg["createdAt"]).timestamp()
+    except Exception:
+        return time.time()
+
+
+async def _send_bodies(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    mailbox_id: int,
+    bodies: List[Tuple[str, str]],
+) -> None:
+    """Send a chat's mails oldest-first; an id counts as seen only once its body went out"""
+    for mid, text in bodies:
+        try:
+            await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+        except Exception:
+            # stop here to keep the order; the rest is retried next tick
+            return
+        _remember_seen(chat_id, mid)
+        OTP_SENT.get(chat_id, set()).discard(mid)
+        PENDING_SEEN.append((chat_id, mid, int(time.time()), mailbox_id))
+
+
+async def _flush_seen() -> None:
+    """Persist ids delivered since the last flush in one transaction"""
+    rows = PENDING_SEEN[:]
+    PENDING_SEEN.clear()
+    await adb(db_mark_seen_many, rows)
+
+
+async def _poll_one(
+    context: ContextTypes.DEFAULT_TYPE,
+    client: httpx.AsyncClient,
+    chat_id: int,
+    mailbox_id: int,
+    token: str,
+    pruned_at: Optional[int],
+    sem: asyncio.Semaphore,
+) -> None:
+    """Forward unseen mail for one chat: OTPs right away, full bodies via a background task"""
+    task = BODY_TASKS.get(chat_id)
+    if task is not None and not task.done():
+        # last cycle's bodies are still going out; their ids aren't marked seen yet
+        return
+
+    try:
+        async with sem:
+            msgs = await mailtm_list_messages(client, token)
+    except Exception:
+        return
+
+    # send unseen messages oldest-first; mail created at or before pruned_at may
+    # have lost its seen row to db_prune_seen, so it is treated as delivered
+    seen = await _load_seen(chat_id)
+    new_ids = [
+        m["id"] for m in msgs
+        if m.get("id") and m["id"] not in seen and (pruned_at is None or _created_ts(m) > pruned_at)
+    ]
+    if new_ids:
+        # confirm against the db in case the id was evicted from the cache
+        unseen = await adb(db_get_unseen, chat_id, new_ids)
+        for mid in new_ids:
+            if mid not in unseen:
+                _remember_seen(chat_id, mid)
+        new_ids = [mid for mid in new_ids if mid in unseen]
+
+    bodies = []
+    for mid in reversed(new_ids):
+        try:
+            async with sem:
+                full = await mailtm_read_message(client, token, mid)
+            # parsing is CPU-bound; keep it off the event loop (big HTML also off the GIL)
+            html = clip_html(full)
+            if len(html) > HTML_OFFLOAD_BYTES:
+                # ship only the fields format_full_message reads, html already clipped
+                slim = {k: full.get(k) for k in ("from", "subject", "createdAt")}
+                slim["html"] = html
+                loop = asyncio.get_running_loop()
+                text, otp = await loop.run_in_executor(context.bot_data["html_pool"], format_full_message, slim)
+            else:
+                text, otp = await asyncio.to_thread(format_full_message, full)
+            otp_sent = OTP_SENT.setdefault(chat_id, set())
+            if otp and mid not in otp_sent:
+                # tiny OTP message first (once, even if the body is retried); the
+                # full body follows in the background
+                await context.bot.send_message(chat_id=chat_id, text=f"🔐 <code>{otp}</code>", parse_mode=ParseMode.HTML)
+                otp_sent.add(mid)
+        except Exception:
+            # stop here to keep the order; this mail and newer ones are retried next tick
+            break
+        bodies.append((mid, text))
+
+    if bodies:
+        BODY_TASKS[chat_id] = context.application.create_task(_send_bodies(context, chat_id, mailbox_id, bodies))
+
+
 async def poll_all_chats(context: ContextTypes.DEFAULT_TYPE) -> None:
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT chat_id, mailbox_id FROM active_mailbox")
-    actives = cur.fetchall()
-    con.close()
+    await _flush_seen()
+    actives = await adb(db_list_active_mailboxes)
 
     if not actives:
         return
 
-    async with httpx.AsyncClient(timeout=25) as client:
-        for chat_id, mailbox_id in actives:
-            token = db_get_token(chat_id, mailbox_id)
-            if not token:
-                continue
-
-            try:
-                msgs = await mailtm_list_messages(client, token)
-            except Exception:
-                continue
+    client = context.bot_data["http"]
+    sem = asyncio.Semaphore(POLL_CONCURRENCY)
+    await asyncio.gather(
+        *(
+            _poll_one(context, client, chat_id, mailbox_id, token, pruned_at, sem)
+            for chat_id, mailbox_id, token, pruned_at in actives
+        ),
+        return_exceptions=True,
+    )
 
-            # send unseen messages oldest-first
-            new_ids = []
-            for m in msgs:
-                mid = m.get("id")
-                if mid and not db_is_seen(chat_id, mid):
-                    new_ids.append(mid)
 
-            for mid in reversed(new_ids):
-                try:
-                    full = await mailtm_read_message(client, token, mid)
-                    text = format_full_message(full)
-                    await context.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
-                    db_mark_seen(chat_id, mid)
-                except Exception:
-                    continue
+async def cleanup_seen(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await adb(db_prune_seen, int(time.time()) - SEEN_RETENTION_DAYS * 86400)
 
 
 # =========================
@@ -646,16 +929,42 @@ def run_port_server():
 # =========================
 # MAIN
 # =========================
+async def post_init(app: Application) -> None:
+    # one keep-alive (HTTP/2) client to mail.tm for the lifetime of the bot
+    app.bot_data["http"] = httpx.AsyncClient(
+        http2=True,
+        base_url=MAILTM_BASE,
+        timeout=25,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=50),
+    )
+    # separate processes for parsing large HTML bodies
+    app.bot_data["html_pool"] = ProcessPoolExecutor(max_workers=2)
+
+
+async def post_shutdown(app: Application) -> None:
+    client = app.bot_data.pop("http", None)
+    if client is not None:
+        await client.aclose()
+    # body tasks were awaited by Application.stop(); keep what they delivered
+    await _flush_seen()
+    pool = app.bot_data.pop("html_pool", None)
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
 def main():
     init_db()
     bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
     if not bot_token:
         raise RuntimeError("Missing TELEGRAM_BOT_TOKEN env var")
 
-    # Start Render port server
-    threading.Thread(target=run_port_server, daemon=True).start()
-
-    app = Application.builder().token(bot_token).build()
+    app = (
+        Application.builder()
+        .token(bot_token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     app.add_handler(MessageHandler(filters.TEXT | filters.COMMAND, handle_text))
 
     # Auto-forward emails
@@ -665,7 +974,27 @@ def main():
         first=5
     )
 
-    app.run_polling(close_loop=False)
+    # Keep seen_messages small
+    app.job_queue.run_repeating(
+        cleanup_seen,
+        interval=86400,
+        first=3600
+    )
+
+    if WEBHOOK_URL:
+        # PTB's webhook server binds PORT itself (also satisfies Render)
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=bot_token,
+            webhook_url=f"{WEBHOOK_URL}/{bot_token}",
+            close_loop=False,
+        )
+    else:
+        # Start Render port server
+        threading.Thread(target=run_port_server, daemon=True).start()
+        # long-poll: Telegram holds getUpdates open until an update arrives
+        app.run_polling(timeout=50, poll_interval=0.0, close_loop=False)
 
 
 if __name__ == "__main__":